@@ -52,10 +52,11 @@ amps   coulombs seconds
 """
 import math
 import random
-import re
+import sys
+from array import array
 from bisect import bisect_left
-from collections import defaultdict, OrderedDict
-from typing import Iterator, Literal, NamedTuple
+from functools import lru_cache
+from typing import Literal
 
 
 def lhs(**kwargs: int) -> dict[str, int]:
@@ -81,7 +82,26 @@ CONVERSIONS = (
     ( 7, {**lhs(week=1), **rhs(day=1)}),
 )
 
-SI_PREFIXES = OrderedDict({
+# Struct-of-arrays unit representation: every unit name gets a fixed slot, and a
+# quantity's units become one small signed-byte vector of exponents instead of a dict.
+# Interned so unit-name comparisons and dict probes are pointer checks.
+UNIT_NAMES: tuple[str, ...] = tuple(dict.fromkeys(
+    sys.intern(unit)
+    for _, conversion in CONVERSIONS
+    for unit in conversion
+))
+UNIT_INDEX: dict[str, int] = {unit: i for i, unit in enumerate(UNIT_NAMES)}
+N_UNITS = len(UNIT_NAMES)
+
+
+def encode_units(units: dict[str, int]) -> array:
+    vec = array('b', bytes(N_UNITS))
+    for unit, exp in units.items():
+        vec[UNIT_INDEX[unit]] = exp
+    return vec
+
+
+SI_PREFIXES = {
     -30: 'quecto',
     -27: 'ronto',
     -24: 'yocto',
@@ -107,25 +127,58 @@ SI_PREFIXES = OrderedDict({
      24: 'yotta',
      27: 'ronna',
      30: 'quetta',
-})
+}
+
+# Parallel sorted views of SI_PREFIXES, hoisted so get_si indexes rather than
+# rebuilding the key tuple and slicing it per call.
+SI_KEYS: tuple[int, ...] = tuple(SI_PREFIXES.keys())
+SI_NAMES: tuple[str, ...] = tuple(SI_PREFIXES.values())
 
 
+@lru_cache(maxsize=None)
 def format_exp(unit: str, exp: int, natural_sign: Literal[1, -1]) -> str:
     if exp == natural_sign:
         return unit
     return f'{unit}^{exp * natural_sign}'
 
 
+_LOG10_2 = 0.30102999566398120
+
+
+def floor_log10(x: float) -> int:
+    '''
+    floor(log10(|x|)) from the binary exponent that frexp pulls straight out of
+    the float's bits, scaled by log10(2). The estimate from the exponent alone
+    can land one decade low, so nudge it across the boundary if needed.
+    '''
+    x = abs(x)
+    exp = math.floor((math.frexp(x)[1] - 1) * _LOG10_2)
+    if x >= 10.0 ** (exp + 1):
+        exp += 1
+    elif x < 10.0 ** exp:
+        exp -= 1
+    return exp
+
+
+# The unit set is fixed at import, so the plural decision is precomputed per
+# unit; get_plural remains for callers passing whole formatted strings.
+PLURAL: dict[str, str] = {
+    unit: '' if unit.endswith(('s', 'z')) else 's'
+    for unit in UNIT_NAMES
+}
+
+
 def get_plural(unit: str) -> str:
-    if re.search(r'[sz]$', unit):
+    if unit.endswith(('s', 'z')):
         return ''
     return 's'
 
 
-def get_si(x: float, num_powers: list[int], den_powers: list[int]) -> tuple[
+def get_si(x: float, num_powers: tuple[int, ...], den_powers: tuple[int, ...]) -> tuple[
     int, str, str,
 ]:
-    keys = tuple(SI_PREFIXES.keys())
+    keys = SI_KEYS
+    names = SI_NAMES
 
     use_num = len(num_powers) == 1 and random.random() < 0.50
     use_den = len(den_powers) == 1 and random.random() < 0.50
@@ -134,125 +187,152 @@ def get_si(x: float, num_powers: list[int], den_powers: list[int]) -> tuple[
     i.e. it's (km)^2.
     adding 'k' (10**3) is as if you added 10**6, so divide this exponent by 2
     '''
-    exp = math.floor(math.log10(abs(x)))
+    exp = floor_log10(x)
     exp_new = 0
 
     if use_num:
-        num_min = max(min(keys), (exp - 6)/num_powers[0])
-        num_max = min(max(keys), (exp + 6)/num_powers[0])
-        num_choices = keys[
-            bisect_left(keys, num_min):
-            bisect_left(keys, num_max)
-        ]
-        num = random.choice(num_choices)
-        num_pre = SI_PREFIXES[num]
+        num_min = max(keys[0], (exp - 6)/num_powers[0])
+        num_max = min(keys[-1], (exp + 6)/num_powers[0])
+        i = bisect_left(keys, num_min)
+        i += random.randrange(bisect_left(keys, num_max) - i)
+        num = keys[i]
+        num_pre = names[i]
         exp_new = exp - num*num_powers[0]
     else:
         num_pre, num, exp_new = '', 0, exp
 
     if use_den:
-        den_min = max(min(keys), exp_new - 6)
-        den_max = min(max(keys), exp_new + 6)
-        den_choices = keys[
-            bisect_left(keys, den_min):
-            bisect_left(keys, den_max) + 1
-        ]
-        den = random.choice(den_choices)
-        den_pre = SI_PREFIXES[den]
+        den_min = max(keys[0], exp_new - 6)
+        den_max = min(keys[-1], exp_new + 6)
+        i = bisect_left(keys, den_min)
+        i += random.randrange(bisect_left(keys, den_max) + 1 - i)
+        den = keys[i]
+        den_pre = names[i]
     else:
         den_pre, den = '', 0
 
     return den - num, num_pre, den_pre
 
 
-class Quantity(NamedTuple):
-    coeff: float
-    units: dict[str, int]
+class Quantity:
+    __slots__ = ('coeff', 'vec')
 
-    def unit_pairs(self, units: dict[str, int], sign: Literal[1, -1]) -> Iterator[tuple[str, int]]:
-        for unit in units.keys() | self.units.keys():
-            new_exp = units.get(unit, 0) + sign * self.units.get(unit, 0)
-            if new_exp != 0:
-                yield unit, new_exp
+    def __init__(self, coeff: float, vec: array) -> None:
+        self.coeff = coeff
+        self.vec = vec
+
+    @classmethod
+    def from_units(cls, coeff: float, units: dict[str, int]) -> 'Quantity':
+        return cls(coeff, encode_units(units))
+
+    @property
+    def units(self) -> dict[str, int]:
+        return {
+            unit: exp
+            for unit, exp in zip(UNIT_NAMES, self.vec)
+            if exp != 0
+        }
 
     def multiply(self, other: 'Quantity', target_unit: str) -> 'Quantity':
-        sign = 1 if self.units[target_unit] < other.units[target_unit] else -1
+        i = UNIT_INDEX[target_unit]
+        sign = 1 if self.vec[i] < other.vec[i] else -1
         return Quantity(
-            coeff=self.coeff**sign * other.coeff,
-            units=dict(self.unit_pairs(other.units, sign)),
+            # sign is ±1, so this is a multiply-or-divide, not a libm pow
+            coeff=self.coeff * other.coeff if sign == 1 else other.coeff / self.coeff,
+            vec=array('b', (
+                sign*a + b for a, b in zip(self.vec, other.vec)
+            )),
         )
 
     @property
     def reciprocal(self) -> 'Quantity':
         return Quantity(
             coeff=1/self.coeff,
-            units={unit: -exp for unit, exp in self.units.items()},
+            vec=array('b', (-exp for exp in self.vec)),
         )
 
     def random_convert(self, max_rounds: int = 2) -> 'Quantity':
-        output = self
-        if random.random() < 0.20:
-            output = output.reciprocal
-
-        n_rounds = random.randint(1, max_rounds)
-        for _ in range(n_rounds):
-            reduce_options = tuple(output.units.keys())
-            target_unit = random.choice(reduce_options)
-            conv_index = CONV_BY_UNIT[target_unit]
-            entry = conv_index.pick_random()
-            output = entry.multiply(output, target_unit)
-        return output
-
-    def format_numerator(self) -> tuple[str, str, list[int]]:
-        pairs = [
-            (unit, exp)
-            for unit, exp in self.units.items()
-            if exp > 0
-        ]
-
-        if not pairs:
-            return 'inverse', '', []
-
-        *num_others, (num_last_unit, num_last_exp) = pairs
-        num = ' '.join(format_exp(*pair, 1) for pair in num_others)
-        num_sep = ' ' if num_others else ''
-
-        plural = get_plural(num_last_unit)
-
+        coeff = self.coeff
+        vec = self.vec
+        if _random() < 0.20:
+            coeff = 1/coeff
+            vec = array('b', (-exp for exp in vec))
+
+        # max_rounds is 2 in practice: one random bit beats randrange's
+        # generic modular path
+        if max_rounds == 2:
+            n_rounds = 1 + _getrandbits(1)
+        else:
+            n_rounds = 1 + _randrange(max_rounds)
+        return Quantity(*_convert_rounds(coeff, vec, n_rounds))
+
+    def random_convert_batch(self, n: int, max_rounds: int = 2) -> list['Quantity']:
+        rand = _random
+        getrandbits = _getrandbits
+        randrange = _randrange
+        two_rounds = max_rounds == 2
+        convert = _convert_rounds
+        quantity = Quantity
+        coeff = self.coeff
+        vec = self.vec
+        recip_coeff = 1/coeff
+        recip_vec = array('b', (-exp for exp in vec))
+
+        results = []
+        append = results.append
+        for _ in range(n):
+            if two_rounds:
+                n_rounds = 1 + getrandbits(1)
+            else:
+                n_rounds = 1 + randrange(max_rounds)
+            if rand() < 0.20:
+                append(quantity(*convert(recip_coeff, recip_vec, n_rounds)))
+            else:
+                append(quantity(*convert(coeff, vec, n_rounds)))
+        return results
+
+    def format_sides(self) -> tuple[str, str, list[int], str, list[int]]:
+        num = ''
+        num_last_unit = None
+        num_last_exp = 0
+        num_powers: list[int] = []
+        den = ''
+        den_sep = ''
+        den_powers: list[int] = []
+        for unit, exp in zip(UNIT_NAMES, self.vec):
+            if exp > 0:
+                if num_last_unit is not None:
+                    num = f'{num}{format_exp(num_last_unit, num_last_exp, 1)} '
+                num_last_unit, num_last_exp = unit, exp
+                num_powers.append(exp)
+            elif exp < 0:
+                den = f'{den}{den_sep}{format_exp(unit, exp, -1)}'
+                den_sep = ' '
+                den_powers.append(exp)
+
+        if num_last_unit is None:
+            return 'inverse', '', num_powers, den, den_powers
+
+        plural = PLURAL[num_last_unit]
         return (
-            format_exp(f'{num}{num_sep}{num_last_unit}{plural}', num_last_exp, 1),
+            format_exp(f'{num}{num_last_unit}{plural}', num_last_exp, 1),
             'per ',
-            [p[1] for p in pairs],
-        )
-
-    def format_denominator(self) -> tuple[str, list[int]]:
-        pairs = [
-            (unit, exp)
-            for unit, exp in self.units.items()
-            if exp < 0
-        ]
-        div_str = ' '.join(
-            format_exp(unit, exp, -1) for unit, exp in pairs
+            num_powers,
+            den,
+            den_powers,
         )
-        return div_str, [p[1] for p in pairs]
 
     def to_string(self, maybe_si: bool = False) -> str:
-        num_units, division, num_powers = self.format_numerator()
-        den, den_powers = self.format_denominator()
-        if den and division != 'per ':
-            den += get_plural(den)
+        num_units, division, num_powers, den, den_powers = _format_units(bytes(self.vec))
 
         if maybe_si:
             exp_adj, prefix_num, prefix_den = get_si(self.coeff, num_powers, den_powers)
         else:
-            si_num_exp, si_den_exp, prefix_num, prefix_den = 0, 0, '', ''
+            exp_adj, prefix_num, prefix_den = 0, '', ''
 
         coeff = self.coeff * 10**exp_adj
-        coeff_num = f'{coeff:,} {prefix_num}{num_units}'
-
-        if den:
-            return f'{coeff_num} {division}{prefix_den}{den}'
-        return coeff_num
+        div_tail = f' {division}{prefix_den}{den}' if den else ''
+        return f'{coeff:,} {prefix_num}{num_units}{div_tail}'
 
     def __repr__(self) -> str:
         return str(self)
@@ -261,45 +341,109 @@ class Quantity(NamedTuple):
         return self.to_string()
 
 
-class ConvIndex:
-    def __init__(self):
-        self.conversions: list[Quantity] = []
+@lru_cache(maxsize=None)
+def _format_units(key: bytes) -> tuple[str, str, tuple[int, ...], str, tuple[int, ...]]:
+    '''
+    The unit side of to_string depends only on the exponent vector, so key the
+    whole thing on the frozen vector bytes and format each combination once.
+    '''
+    quantity = Quantity(1.0, array('b', key))
+    num_units, division, num_powers, den, den_powers = quantity.format_sides()
+    if den and division != 'per ':
+        den += get_plural(den)
+    return num_units, division, tuple(num_powers), den, tuple(den_powers)
 
-    def add(self, coeff: float, units: dict[str, int]):
-        self.conversions.append(Quantity(coeff, units))
 
-    def pick_random(self) -> Quantity:
-        return random.choice(self.conversions)
+_random = random.random
+_randrange = random.randrange
+_getrandbits = random.getrandbits
 
-    @classmethod
-    def index_all(cls) -> dict[str, 'ConvIndex']:
-        by_unit = defaultdict(cls)
 
-        for conv_pair in CONVERSIONS:
-            coefficient, conversion = conv_pair
-            for unit, exponent in conversion.items():
-                by_unit[unit].add(*conv_pair)
+def _flatten_conversions() -> tuple[array, tuple[array, ...], array]:
+    '''
+    CSR-style flattening of CONVERSIONS keyed by unit slot: the conversions
+    applicable to unit slot i are rows CONV_OFFSETS[i]:CONV_OFFSETS[i + 1].
+    '''
+    by_slot: list[list[tuple[float, array]]] = [[] for _ in range(N_UNITS)]
+    for coefficient, conversion in CONVERSIONS:
+        entry_vec = encode_units(conversion)
+        for unit in conversion:
+            by_slot[UNIT_INDEX[unit]].append((coefficient, entry_vec))
 
-        return by_unit
+    coeffs = array('d')
+    vecs: list[array] = []
+    offsets = array('l', (0,))
+    for entries in by_slot:
+        for entry_coeff, entry_vec in entries:
+            coeffs.append(entry_coeff)
+            vecs.append(entry_vec)
+        offsets.append(len(vecs))
+    return coeffs, tuple(vecs), offsets
 
-    def __str__(self) -> str:
-        return ', '.join(str(c) for c in self.conversions)
 
-    def __repr__(self) -> str:
-        return str(self)
+CONV_COEFFS, CONV_VECS, CONV_OFFSETS = _flatten_conversions()
+
+
+def _specialize(entry_coeff: float, entry_vec: array, target: int):
+    '''
+    Synthesize straight-line source for one (target unit, conversion) pair: the
+    coefficient and the nonzero exponent deltas become literals, so applying a
+    conversion is a handful of indexed adds with no table walk.
+    '''
+    body = [
+        'def convert(coeff, vec):',
+        f'    sign = 1 if {entry_vec[target]} < vec[{target}] else -1',
+        "    vec = _array('b', vec)",
+    ]
+    body += [
+        f'    vec[{i}] += sign*{exp}'
+        for i, exp in enumerate(entry_vec)
+        if exp != 0
+    ]
+    # both the coefficient and its reciprocal become literals: always a
+    # multiply, never float.__pow__
+    body.append(
+        f'    return coeff * ({entry_coeff!r} if sign == 1 else {1/entry_coeff!r}), vec'
+    )
+    namespace = {'_array': array}
+    exec('\n'.join(body), namespace)
+    return namespace['convert']
+
+
+SPECIALIZED = tuple(
+    _specialize(entry_coeff, entry_vec, target)
+    for target in range(N_UNITS)
+    for entry_coeff, entry_vec in zip(
+        CONV_COEFFS[CONV_OFFSETS[target]:CONV_OFFSETS[target + 1]],
+        CONV_VECS[CONV_OFFSETS[target]:CONV_OFFSETS[target + 1]],
+    )
+)
 
 
-CONV_BY_UNIT = ConvIndex.index_all()
+def _convert_rounds(coeff: float, vec: array, n_rounds: int) -> tuple[float, array]:
+    specialized = SPECIALIZED
+    offsets = CONV_OFFSETS
+    randrange = _randrange
+    for _ in range(n_rounds):
+        nonzero = tuple(i for i, exp in enumerate(vec) if exp != 0)
+        target = nonzero[randrange(len(nonzero))]
+        start = offsets[target]
+        k = start + randrange(offsets[target + 1] - start)
+        coeff, vec = specialized[k](coeff, vec)
+    return coeff, vec
 
 
 def demo() -> None:
-    start = Quantity(2e3, {'volt': 1})
-    # start = Quantity(1, {'jiffy': 1})
-    results = {
-        start.random_convert().to_string(maybe_si=True)
-        for _ in range(100)
-    }
-    print('\n'.join(results))
+    start = Quantity.from_units(2e3, {'volt': 1})
+    # start = Quantity.from_units(1, {'jiffy': 1})
+    # dedupe on the cheap structural key so duplicates never reach the
+    # formatter
+    results: dict[tuple[float, bytes], str] = {}
+    for converted in start.random_convert_batch(100):
+        key = converted.coeff, converted.vec.tobytes()
+        if key not in results:
+            results[key] = converted.to_string(maybe_si=True)
+    print('\n'.join(results.values()))
 
 
 if __name__ == '__main__':